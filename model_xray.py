@@ -1,85 +1,128 @@
+import argparse
+import heapq
 import inspect
+import io
+import sys
+import time
+from itertools import islice
 import torch
-from transformers import Qwen3VLModel, AutoProcessor
+from accelerate import init_empty_weights
+from transformers import Qwen3VLConfig, Qwen3VLModel, AutoProcessor
 
 def model_xray(model, max_modules=80, max_params=80):
-    print("=== TYPE ===")
-    print(type(model))
-    print("module:", model.__class__.__module__)
-    print()
+    # Buffer the whole report and hand it to stdout in one write; the report is
+    # usually redirected to a file for xray_report_viz.py
+    out = io.StringIO()
 
-    print("=== MRO (inheritance) ===")
+    out.write("=== TYPE ===\n")
+    out.write(f"{type(model)}\n")
+    out.write(f"module: {model.__class__.__module__}\n")
+    out.write("\n")
+
+    out.write("=== MRO (inheritance) ===\n")
     for c in model.__class__.__mro__[:8]:
-        print(" ", c)
-    print()
+        out.write(f"  {c}\n")
+    out.write("\n")
 
-    print("=== INSTANCE __dict__ keys (dynamic attrs) ===")
-    print(sorted(list(model.__dict__.keys()))[:80])
-    print()
+    out.write("=== INSTANCE __dict__ keys (dynamic attrs) ===\n")
+    # only the first 80 keys in sort order are shown, no need to sort them all
+    out.write(f"{heapq.nsmallest(80, model.__dict__)}\n")
+    out.write("\n")
 
-    print("=== TOP-LEVEL _modules keys ===")
-    print(sorted(list(model._modules.keys())))
-    print()
+    out.write("=== TOP-LEVEL _modules keys ===\n")
+    out.write(f"{sorted(model._modules)}\n")
+    out.write("\n")
 
-    print("=== named_modules (first few) ===")
+    # islice stops the tree walk once enough entries are collected; named_modules
+    # yields the root (empty name) first, so start at 1 to skip it
+    out.write("=== named_modules (first few) ===\n")
     i = 0
-    for name, mod in model.named_modules():
-        if name == "":
-            continue
-        print(f"{name:60s} {type(mod).__name__}")
+    for name, mod in islice(model.named_modules(), 1, max_modules + 1):
+        out.write(f"{name:60s} {type(mod).__name__}\n")
         i += 1
-        if i >= max_modules:
-            print("... truncated ...")
-            break
-    print()
+    if i >= max_modules:
+        out.write("... truncated ...\n")
+    out.write("\n")
 
-    print("=== named_parameters (first few) ===")
+    out.write("=== named_parameters (first few) ===\n")
     i = 0
-    for name, p in model.named_parameters():
-        print(f"{name:70s} shape={tuple(p.shape)} dtype={p.dtype} req_grad={p.requires_grad}")
+    for name, p in islice(model.named_parameters(), max_params):
+        out.write(f"{name:70s} shape={tuple(p.shape)} dtype={p.dtype} req_grad={p.requires_grad}\n")
         i += 1
-        if i >= max_params:
-            print("... truncated ...")
-            break
-    print()
-
-    print("=== named_buffers (first few) ===")
-    for name, b in list(model.named_buffers())[:40]:
-        print(f"{name:70s} shape={tuple(b.shape)} dtype={b.dtype}")
-    print()
-
-    print("=== SOURCE FILES ===")
-    try:
-        print("class file:", inspect.getsourcefile(model.__class__))
-    except Exception as e:
-        print("class file: <unavailable>", e)
-    try:
-        print("forward file:", inspect.getsourcefile(model.forward),
-              "line", inspect.getsourcelines(model.forward)[1])
-    except Exception as e:
-        print("forward file: <unavailable>", e)
-
-    print()
+    if i >= max_params:
+        out.write("... truncated ...\n")
+    out.write("\n")
+
+    out.write("=== named_buffers (first few) ===\n")
+    for name, b in islice(model.named_buffers(), 40):
+        out.write(f"{name:70s} shape={tuple(b.shape)} dtype={b.dtype}\n")
+    out.write("\n")
+
+    # Read locations off the class module and the code object instead of
+    # getsourcelines, which re-reads and tokenizes the whole source file
+    out.write("=== SOURCE FILES ===\n")
+    out.write(f"class file: {inspect.getfile(model.__class__)}\n")
+    fwd = inspect.unwrap(getattr(model.forward, "__func__", model.forward))
+    out.write(f"forward file: {inspect.getsourcefile(fwd)} line {fwd.__code__.co_firstlineno}\n")
+
+    out.write("\n")
     if hasattr(model, "config"):
-        print("=== CONFIG ===")
-        d = model.config.to_dict()
-        print("config class:", type(model.config))
-        print("config keys (sample):", list(d.keys())[:80])
+        out.write("=== CONFIG ===\n")
+        # Only key names are printed, so skip to_dict() and its deep copy of every sub-config
+        out.write(f"config class: {model.config.__class__.__name__}\n")
+        out.write(f"config keys (sample): {list(model.config.__dict__.keys())[:80]}\n")
+
+    sys.stdout.write(out.getvalue())
 
 if __name__ == "__main__":
     MODEL_NAME = "Qwen/Qwen3-VL-2B-Instruct"
-    
+
+    ap = argparse.ArgumentParser(description="Inspect the submodules and attributes of a model")
+    ap.add_argument("--device-map", default="auto",
+                    help="device_map passed to from_pretrained on CUDA, e.g. auto or balanced")
+    ap.add_argument("--load-weights", action="store_true",
+                    help="Load the real weights instead of building the model on the meta device")
+    args = ap.parse_args()
+
     device = "cuda" if torch.cuda.is_available() else "cpu"
     print(f"Using device: {device}")
+    dtype = torch.float16 if device == "cuda" else torch.float32
+
+    if args.load_weights:
+        if device == "cuda":
+            torch.backends.cudnn.benchmark = True
+
+        print("Loading processor & model...")
+        processor = AutoProcessor.from_pretrained(MODEL_NAME)
+        # Load weights straight onto the GPU; device_map="auto" is unreliable on CPU-only runs.
+        # safetensors shards are mmap'ed and copied per tensor, no pickled state_dict on CPU.
+        # The copies go on a side stream; later CUDA work waits on it instead of on
+        # the default stream (torch.cuda.stream(None) is a no-op on CPU).
+        load_stream = torch.cuda.Stream() if device == "cuda" else None
+        with torch.cuda.stream(load_stream):
+            model = Qwen3VLModel.from_pretrained(
+                MODEL_NAME,
+                torch_dtype=dtype,
+                device_map=args.device_map if device == "cuda" else None,
+                low_cpu_mem_usage=True,
+                use_safetensors=True,
+                attn_implementation="sdpa",
+            )
+        if load_stream is not None:
+            torch.cuda.current_stream().wait_stream(load_stream)
+    else:
+        # The xray only reads structure, shapes and dtypes, which meta tensors
+        # carry without downloading or allocating any weights
+        print("Building model on meta device...")
+        config = Qwen3VLConfig.from_pretrained(MODEL_NAME)
+        with init_empty_weights():
+            model = Qwen3VLModel._from_config(config, torch_dtype=dtype, attn_implementation="sdpa")
+
+    # Nothing here trains; keep any later probe in this process free of autograd and dropout
+    model.eval()
+    torch.set_grad_enabled(False)
 
-    if device == "cuda":
-        torch.backends.cudnn.benchmark = True
-
-    print("Loading processor & model...")
-    processor = AutoProcessor.from_pretrained(MODEL_NAME)
-    model = Qwen3VLModel.from_pretrained(
-        MODEL_NAME,
-        torch_dtype=torch.float16 if device == "cuda" else torch.float32,
-        device_map=None,
-    ).to(device)
-    model_xray(model)
\ No newline at end of file
+    # model_xray is host-side Python only, so time it on the host clock
+    t0 = time.perf_counter()
+    model_xray(model)
+    print(f"model_xray took {(time.perf_counter() - t0) * 1000:.1f} ms")
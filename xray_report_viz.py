@@ -25,15 +25,16 @@ Assumptions about report format
 from __future__ import annotations
 
 import argparse
-import re
+import io
 from dataclasses import dataclass
+from functools import lru_cache
 from collections import defaultdict
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, TextIO, Tuple
 
 
-NAMED_MODULES_HEADER_RE = re.compile(r"^===\s+named_modules\b", re.IGNORECASE)
-SECTION_HEADER_RE = re.compile(r"^===\s+\S+")
-LINE_RE = re.compile(r"^(?P<path>\S+)\s+(?P<cls>.+?)\s*$")
+# str.translate tables: brackets removed from labels, ASCII non-id chars mapped to "_"
+_LABEL_STRIP = str.maketrans("", "", "()[]{}")
+_ID_TABLE = str.maketrans({chr(c): "_" for c in range(128) if not (chr(c).isalnum() or chr(c) == "_")})
 
 
 @dataclass(frozen=True)
@@ -43,56 +44,64 @@ class Node:
 
 
 def path_depth(path: str) -> int:
-    return len(path.split("."))
+    return path.count(".") + 1
 
 
 def sanitize_label(s: str) -> str:
     # User requirement: do not include parentheses in text
-    s = s.replace("(", "").replace(")", "")
-    s = s.replace("[", "").replace("]", "")
-    s = s.replace("{", "").replace("}", "")
-    return s
+    return s.translate(_LABEL_STRIP)
 
 
+@lru_cache(maxsize=None)
 def mermaid_id_for_path(path: str) -> str:
     # Mermaid node ids: keep alnum and underscore only
-    out = []
-    for ch in path:
-        if ch.isalnum() or ch == "_":
-            out.append(ch)
-        else:
-            out.append("_")
-    if out and out[0].isdigit():
-        out.insert(0, "n_")
-    return "".join(out)
+    if path.isascii():
+        out = path.translate(_ID_TABLE)
+    else:
+        out = "".join(ch if ch.isalnum() or ch == "_" else "_" for ch in path)
+    if out[:1].isdigit():
+        out = "n_" + out
+    return out
+
+
+def is_section_header(s: str) -> bool:
+    # "=== <title>", s already stripped
+    return s.startswith("===") and s[3:4].isspace()
+
+
+def is_named_modules_header(s: str) -> bool:
+    # "=== named_modules" as a whole word, case-insensitive, s already stripped
+    if not is_section_header(s):
+        return False
+    title = s[3:].lstrip()[:14].lower()
+    return title.startswith("named_modules") and not (title[13:].isalnum() or title[13:] == "_")
 
 
 def parse_named_modules(report_text: str) -> Dict[str, Node]:
-    lines = report_text.splitlines()
-    in_named = False
+    lines = iter(report_text.splitlines())
     nodes: Dict[str, Node] = {}
 
-    for raw in lines:
-        line = raw.rstrip("\n")
+    # Phase 1: skip ahead to the named_modules header
+    for line in lines:
+        if is_named_modules_header(line.strip()):
+            break
 
-        if not in_named:
-            if NAMED_MODULES_HEADER_RE.match(line.strip()):
-                in_named = True
-            continue
+    # Phase 2: resumes right after the header, reads body lines until the next section
+    for line in lines:
+        stripped = line.strip()
 
-        # stop at next === section
-        if SECTION_HEADER_RE.match(line.strip()) and not NAMED_MODULES_HEADER_RE.match(line.strip()):
+        if is_section_header(stripped) and not is_named_modules_header(stripped):
             break
 
-        if not line.strip():
+        # <module_path><spaces><class_name>; the path never starts with whitespace
+        if not stripped or line[0].isspace():
             continue
 
-        m = LINE_RE.match(line)
-        if not m:
+        parts = stripped.split(None, 1)
+        if len(parts) != 2:
             continue
 
-        path = m.group("path").strip()
-        cls = m.group("cls").strip()
+        path, cls = parts
         nodes[path] = Node(path=path, cls=cls)
 
     return nodes
@@ -100,36 +109,26 @@ def parse_named_modules(report_text: str) -> Dict[str, Node]:
 
 def ensure_parents(nodes: Dict[str, Node]) -> Dict[str, Node]:
     out = dict(nodes)
-    for p in list(nodes.keys()):
-        parts = p.split(".")
-        for i in range(1, len(parts)):
-            parent = ".".join(parts[:i])
+    for p in nodes:
+        # walk every "." in the path; each prefix before it is an ancestor
+        idx = p.find(".")
+        while idx >= 0:
+            parent = p[:idx]
             if parent not in out:
                 out[parent] = Node(path=parent, cls=None)
+            idx = p.find(".", idx + 1)
     return out
 
 
 def filter_by_max_depth(nodes: Dict[str, Node], max_depth: int) -> Dict[str, Node]:
+    # Every path has depth >= 1, nothing can be kept
+    if max_depth <= 0:
+        return {}
     # Keep all nodes with depth <= max_depth
     kept = {p: n for p, n in nodes.items() if path_depth(p) <= max_depth}
-    # Ensure connectivity for kept nodes
-    kept = ensure_parents(kept)
-    kept = {p: n for p, n in kept.items() if path_depth(p) <= max_depth}
-    return kept
-
-
-def build_tree(nodes: Dict[str, Node]) -> Dict[str, List[str]]:
-    tree: Dict[str, List[str]] = defaultdict(list)
-    for path in nodes.keys():
-        if "." not in path:
-            continue
-        parent = path.rsplit(".", 1)[0]
-        if parent in nodes:
-            tree[parent].append(path)
-    # sort children for stable output
-    for parent in list(tree.keys()):
-        tree[parent] = sorted(set(tree[parent]))
-    return tree
+    # Ensure connectivity for kept nodes. Parents are always shallower than
+    # their children, so nothing added here can exceed max_depth.
+    return ensure_parents(kept)
 
 
 def node_label(node: Node) -> str:
@@ -141,74 +140,96 @@ def node_label(node: Node) -> str:
 
 
 def emit_leaf_stack(
-    lines: List[str],
+    out: TextIO,
     parent: str,
     leaf_children: List[str],
     stack_id: str,
+    ids: Dict[str, str],
 ) -> None:
     if not leaf_children:
         return
 
-    leaf_children = sorted(leaf_children)
+    leaf_ids = [ids[c] for c in sorted(leaf_children)]
 
-    lines.append(f"  subgraph {stack_id}")
-    lines.append("    direction TB")
+    out.write(f"  subgraph {stack_id}\n")
+    out.write("    direction TB\n")
 
     # Make a vertical chain
-    for a, b in zip(leaf_children, leaf_children[1:]):
-        lines.append(f"    {mermaid_id_for_path(a)} --> {mermaid_id_for_path(b)}")
+    out.write("".join(f"    {a} --> {b}\n" for a, b in zip(leaf_ids, leaf_ids[1:])))
 
-    lines.append("  end")
+    out.write("  end\n")
 
     # Connect parent to the first leaf in the stack
-    lines.append(f"  {mermaid_id_for_path(parent)} --> {mermaid_id_for_path(leaf_children[0])}")
+    out.write(f"  {ids[parent]} --> {leaf_ids[0]}\n")
 
 
 def generate_mermaid(
     nodes: Dict[str, Node],
     max_depth: int,
     root_label: str,
-) -> str:
+    out: Optional[TextIO] = None,
+) -> Optional[str]:
+    # Lines are written straight to out instead of being collected and joined.
+    # Without out, render into one StringIO buffer and return its text.
+    if out is None:
+        buf = io.StringIO()
+        generate_mermaid(nodes, max_depth, root_label, buf)
+        return buf.getvalue()
+
     # Global direction LR so non leaf sibling fanout stays horizontal
-    lines: List[str] = []
-    lines.append("flowchart LR")
+    out.write("flowchart LR\n")
 
     root_id = "Model"
-    lines.append(f"  {root_id}[{sanitize_label(root_label)}]")
-
-    # Declare nodes
-    for path, node in sorted(nodes.items(), key=lambda x: (path_depth(x[0]), x[0])):
-        nid = mermaid_id_for_path(path)
-        lbl = node_label(node)
-        lines.append(f"  {nid}[{lbl}]")
+    out.write(f"  {root_id}[{sanitize_label(root_label)}]\n")
+
+    # One pass over nodes collects ids, depths, depth buckets, top-level nodes
+    # and the parent -> children tree
+    ids: Dict[str, str] = {}
+    depths: Dict[str, int] = {}
+    by_depth: Dict[int, List[str]] = defaultdict(list)
+    top_level: List[str] = []
+    tree: Dict[str, List[str]] = defaultdict(list)
+    for path in nodes:
+        ids[path] = mermaid_id_for_path(path)
+        depth = path_depth(path)
+        depths[path] = depth
+        by_depth[depth].append(path)
+        dot = path.rfind(".")
+        if dot < 0:
+            top_level.append(path)
+        elif path[:dot] in nodes:
+            tree[path[:dot]].append(path)
+
+    # Declare nodes, shallowest first
+    for depth in sorted(by_depth):
+        for path in sorted(by_depth[depth]):
+            out.write(f"  {ids[path]}[{node_label(nodes[path])}]\n")
 
     # Root connects to top-level nodes
-    top_level = sorted([p for p in nodes.keys() if "." not in p])
-    for t in top_level:
-        lines.append(f"  {root_id} --> {mermaid_id_for_path(t)}")
-
-    # Build parent children
-    tree = build_tree(nodes)
+    out.write("".join(f"  {root_id} --> {ids[t]}\n" for t in sorted(top_level)))
 
     # Emit edges with your layout rule
     stack_counter = 0
     for parent in sorted(tree.keys()):
+        # sort children for stable output; node paths are unique and each has one
+        # parent, so there are no duplicates to drop
         children = tree[parent]
+        children.sort()
 
-        leaf_children = [c for c in children if path_depth(c) == max_depth]
-        nonleaf_children = [c for c in children if path_depth(c) < max_depth]
+        leaf_children = [c for c in children if depths[c] == max_depth]
+        nonleaf_children = [c for c in children if depths[c] < max_depth]
 
-        # Non leaf fanout stays horizontal
-        for c in nonleaf_children:
-            lines.append(f"  {mermaid_id_for_path(parent)} --> {mermaid_id_for_path(c)}")
+        # Non leaf fanout stays horizontal, one write per parent
+        pid = ids[parent]
+        out.write("".join(f"  {pid} --> {ids[c]}\n" for c in nonleaf_children))
 
         # Leaf siblings vertical stack
         if leaf_children:
             stack_counter += 1
-            stack_id = f"leafstack_{mermaid_id_for_path(parent)}_{stack_counter}"
-            emit_leaf_stack(lines, parent, leaf_children, stack_id)
+            stack_id = f"leafstack_{pid}_{stack_counter}"
+            emit_leaf_stack(out, parent, leaf_children, stack_id, ids)
 
-    return "\n".join(lines) + "\n"
+    return None
 
 
 def main() -> None:
@@ -231,11 +252,9 @@ def main() -> None:
     all_nodes = ensure_parents(explicit)
     nodes = filter_by_max_depth(all_nodes, args.max_depth)
 
-    mermaid = generate_mermaid(nodes, max_depth=args.max_depth, root_label=args.root_label)
-
     with open(args.out, "w", encoding="utf-8") as f:
         f.write("```mermaid\n")
-        f.write(mermaid)
+        generate_mermaid(nodes, max_depth=args.max_depth, root_label=args.root_label, out=f)
         f.write("```\n")
 
     print(f"Wrote: {args.out}")